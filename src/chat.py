@@ -1,26 +1,53 @@
 # chat.py
 import asyncio, datetime
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
 from src.database import messages_collection, device_tokens_collection
 from src import crud
-from src.notifications import send_push_notification
+from src.notifications import send_push_batch
+
+async def send_json(websocket: WebSocket, message: dict):
+    # orjson gère datetime nativement ; default=str couvre l'ObjectId ajouté par insert_one
+    await websocket.send_text(orjson.dumps(message, default=str).decode())
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: dict[str, WebSocket] = {}  # user_id -> websocket
+        self.matches: dict[str, set[str]] = {}  # user_id -> matchs (cache par connexion)
 
     async def connect(self, user_id: str, websocket: WebSocket):
         await websocket.accept()
         self.active_connections[user_id] = websocket
+        self.matches[user_id] = set(await crud.get_matches(user_id))
 
     def disconnect(self, user_id: str):
         if user_id in self.active_connections:
             del self.active_connections[user_id]
+        self.matches.pop(user_id, None)
+
+    def notify_new_match(self, user_a: str, user_b: str):
+        # Met à jour le cache des utilisateurs connectés
+        if user_a in self.matches:
+            self.matches[user_a].add(user_b)
+        if user_b in self.matches:
+            self.matches[user_b].add(user_a)
+
+    async def is_match(self, user_id: str, other_id: str) -> bool:
+        if not other_id:
+            return False
+        matches = self.matches.setdefault(user_id, set())
+        if other_id in matches:
+            return True
+        # Le match a pu être créé sur un autre worker : on vérifie seulement cette paire
+        if await crud.is_mutual_like(user_id, other_id):
+            matches.add(other_id)
+            return True
+        return False
 
     async def send_personal_message(self, message: dict, user_id: str):
         websocket = self.active_connections.get(user_id)
         if websocket:
-            await websocket.send_json(message)
+            await send_json(websocket, message)
 
 manager = ConnectionManager()
 
@@ -28,14 +55,13 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
     await manager.connect(user_id, websocket)
     try:
         while True:
-            data = await websocket.receive_json()
+            data = orjson.loads(await websocket.receive_text())
             to_user = data.get("to_user")
             content = data.get("content")
 
             # Vérifie que les deux utilisateurs sont matchés
-            matches = await crud.get_matches(user_id)
-            if to_user not in matches:
-                await websocket.send_json({"error": "Vous ne pouvez envoyer des messages qu'à vos matchs."})
+            if not await manager.is_match(user_id, to_user):
+                await send_json(websocket, {"error": "Vous ne pouvez envoyer des messages qu'à vos matchs."})
                 continue
 
             # Stocke le message
@@ -52,14 +78,13 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             await manager.send_personal_message(message_doc, to_user)
 
             # Notifications push via FCM
-            tokens = await device_tokens_collection.find({"user_id": to_user}).to_list(None)
-            for t in tokens:
-                await send_push_notification(
-                    t["device_token"],
-                    title="Nouveau message",
-                    body=f"Vous avez un nouveau message de {user_id}",
-                    data={"from_user": user_id, "type": "message"}
-                )
+            tokens = await device_tokens_collection.find({"user_id": to_user}, projection={"_id": 0, "device_token": 1}).to_list(None)
+            await send_push_batch(
+                [t["device_token"] for t in tokens],
+                title="Nouveau message",
+                body=f"Vous avez un nouveau message de {user_id}",
+                data={"from_user": user_id, "type": "message"}
+            )
 
     except WebSocketDisconnect:
         manager.disconnect(user_id)
@@ -1,8 +1,10 @@
 # crud.py
+import asyncio
 from bson import ObjectId
-from src.database import users_collection, likes_collection, tokens_collection
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from src.database import users_collection, likes_collection, tokens_collection, messages_collection, device_tokens_collection, crossings_collection
 from datetime import datetime, timezone
-import math
 
 # -------------------
 # Utilisateurs
@@ -14,27 +16,76 @@ async def create_user(user_dict):
 async def get_user_by_username(username: str):
     return await users_collection.find_one({"username": username})
 
-async def get_user(user_id: str):
-    return await users_collection.find_one({"_id": ObjectId(user_id)})
+async def get_user(user_id: str, projection: dict = None):
+    return await users_collection.find_one({"_id": ObjectId(user_id)}, projection=projection)
 
 # -------------------
 # Localisation
 # -------------------
-async def update_location(user_id: str, lat: float, lng: float):
-    await users_collection.update_one(
+async def update_location(user_id: str, lat: float, lng: float, radius_m=100):
+    location = {"type": "Point", "coordinates": [lng, lat]}
+    result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
-        {"$set": {"location": {"type": "Point", "coordinates": [lng, lat]}}}
+        {"$set": {"location": location}}
     )
+    if result.matched_count == 0:
+        return []
+
+    # Croisements détectés à chaque déplacement (un seul $geoNear pour cet utilisateur)
+    nearby = await find_users_near(location, radius_m, {"_id": {"$ne": ObjectId(user_id)}})
+    if nearby:
+        # Un seul document par paire : on met à jour le dernier croisement
+        now = datetime.now(timezone.utc)
+        operations = []
+        for user in nearby:
+            user1_id, user2_id = sorted((user_id, str(user["_id"])))
+            operations.append(UpdateOne(
+                {"user1_id": user1_id, "user2_id": user2_id},
+                {"$set": {"distance": user["distance"], "timestamp": now}},
+                upsert=True
+            ))
+        await crossings_collection.bulk_write(operations, ordered=False)
+    return nearby
 
-# Assure toi que l'index 2dsphere existe (à exécuter une fois)
-async def create_location_index():
+# Supprime les doublons existants (garde le plus ancien document de chaque groupe)
+async def remove_duplicates(collection, fields: list[str]):
+    groups = await collection.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {field: f"${field}" for field in fields}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True).to_list(None)
+    extra_ids = [doc_id for group in groups for doc_id in group["ids"][1:]]
+    if extra_ids:
+        await collection.delete_many({"_id": {"$in": extra_ids}})
+
+async def create_unique_index(collection, fields: list[str]):
+    try:
+        await collection.create_index([(field, 1) for field in fields], unique=True)
+    except OperationFailure as e:
+        # Doublons créés avant l'index (ancien find puis insert) : nettoyage unique puis nouvel essai
+        if e.code != 11000:
+            raise
+        await remove_duplicates(collection, fields)
+        await collection.create_index([(field, 1) for field in fields], unique=True)
+
+# Assure toi que les index existent (exécuté au démarrage)
+async def create_indexes():
     await users_collection.create_index([("location", "2dsphere")])
+    await create_unique_index(likes_collection, ["liker_id", "liked_id"])
+    await likes_collection.create_index([("liked_id", 1)])
+    await create_unique_index(tokens_collection, ["refresh_token"])
+    # TTL : MongoDB supprime lui-même les refresh tokens expirés
+    await tokens_collection.create_index("expires_at", expireAfterSeconds=0)
+    await create_unique_index(device_tokens_collection, ["user_id", "device_token"])
+    # Sert les deux branches du $or de l'historique (égalité from/to puis tri timestamp, _id)
+    await messages_collection.create_index([("from_user", 1), ("to_user", 1), ("timestamp", 1), ("_id", 1)])
+    await create_unique_index(crossings_collection, ["user1_id", "user2_id"])
 
 # -------------------
 # Nearby Users
 # -------------------
-async def get_nearby_users(user_id: str, max_distance_m=100):
-    user = await get_user(user_id)
+async def get_nearby_users(user_id: str, max_distance_m=100, skip: int = 0, limit: int = 20):
+    user = await get_user(user_id, projection={"location": 1})
     if not user or "location" not in user:
         return []
 
@@ -48,59 +99,79 @@ async def get_nearby_users(user_id: str, max_distance_m=100):
             }
         },
         "_id": {"$ne": ObjectId(user_id)}
-    }).to_list(20)  # limite 20 utilisateurs
+    }, projection={"_id": 1, "username": 1, "location": 1}).skip(skip).limit(limit).to_list(None)
 
-    return nearby
+    # ObjectId n'est pas sérialisable en JSON
+    return [{**u, "_id": str(u["_id"])} for u in nearby]
 
 # -------------------
 # Likes & Matches
 # -------------------
 async def create_like(liker_id: str, liked_id: str):
-    # Evite doublons
-    existing = await likes_collection.find_one({"liker_id": liker_id, "liked_id": liked_id})
-    if existing:
+    # Evite doublons (index unique liker_id/liked_id)
+    try:
+        await likes_collection.insert_one({"liker_id": liker_id, "liked_id": liked_id, "created_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
         return {"message": "Like déjà existant"}
 
-    await likes_collection.insert_one({"liker_id": liker_id, "liked_id": liked_id, "created_at": datetime.now(timezone.utc)})
-
     # Vérifie match réciproque
-    reciprocal = await likes_collection.find_one({"liker_id": liked_id, "liked_id": liker_id})
+    reciprocal = await likes_collection.find_one({"liker_id": liked_id, "liked_id": liker_id}, projection={"_id": 1})
     if reciprocal:
         return {"match": True}
     return {"match": False}
 
+async def is_mutual_like(user_a: str, user_b: str):
+    # Deux lookups sur l'index unique liker_id/liked_id
+    like_ab, like_ba = await asyncio.gather(
+        likes_collection.find_one({"liker_id": user_a, "liked_id": user_b}, projection={"_id": 1}),
+        likes_collection.find_one({"liker_id": user_b, "liked_id": user_a}, projection={"_id": 1})
+    )
+    return bool(like_ab and like_ba)
+
 async def get_matches(user_id: str):
-    # Likes reçus et réciproques
-    likes = await likes_collection.find({"liker_id": user_id}).to_list(None)
-    matches = []
-    for like in likes:
-        reciprocal = await likes_collection.find_one({"liker_id": like["liked_id"], "liked_id": user_id})
-        if reciprocal:
-            matches.append(like["liked_id"])
-    return matches
+    # Likes donnés et réciproques, en une seule agrégation
+    likes = await likes_collection.aggregate([
+        {"$match": {"liker_id": user_id}},
+        {"$lookup": {
+            "from": "likes",
+            "let": {"lk": "$liked_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$liker_id", "$$lk"]},
+                    {"$eq": ["$liked_id", user_id]}
+                ]}}},
+                {"$limit": 1}
+            ],
+            "as": "reciprocal"
+        }},
+        {"$match": {"reciprocal": {"$ne": []}}},
+        {"$project": {"_id": 0, "liked_id": 1}}
+    ]).to_list(None)
+    return [like["liked_id"] for like in likes]
 
 # -------------------
 # Détection des croisements
 # -------------------
+async def find_users_near(location: dict, radius_m: float, query: dict):
+    # $geoNear sur l'index 2dsphere, distance en mètres
+    return await users_collection.aggregate([
+        {"$geoNear": {
+            "near": location,
+            "distanceField": "distance",
+            "maxDistance": radius_m,
+            "spherical": True,
+            "query": query
+        }},
+        {"$project": {"_id": 1, "distance": 1}}
+    ]).to_list(None)
+
 async def detect_crossings(radius_m=100):
-    users = await users_collection.find({"location": {"$exists": True}}).to_list(None)
+    # Un $geoNear par utilisateur ; "_id" > a garantit
+    # que chaque paire n'est émise qu'une seule fois
+    users = await users_collection.find({"location": {"$exists": True}}, projection={"location": 1}).to_list(None)
     detected = []
-    for i, user_a in enumerate(users):
-        lng_a, lat_a = user_a["location"]["coordinates"]
-        for user_b in users[i + 1:]:
-            lng_b, lat_b = user_b["location"]["coordinates"]
-            distance = haversine(lat_a, lng_a, lat_b, lng_b)
-            if distance <= radius_m:
-                detected.append((str(user_a["_id"]), str(user_b["_id"])))
+    for user_a in users:
+        nearby = await find_users_near(user_a["location"], radius_m, {"_id": {"$gt": user_a["_id"]}})
+        for user_b in nearby:
+            detected.append((str(user_a["_id"]), str(user_b["_id"])))
     return detected
-
-def haversine(lat1, lon1, lat2, lon2):
-    # Distance en mètres entre deux points GPS
-    R = 6371000  # rayon Terre en m
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    d_phi = math.radians(lat2 - lat1)
-    d_lambda = math.radians(lon2 - lon1)
-
-    a = math.sin(d_phi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(d_lambda/2)**2
-    c = 2*math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
@@ -5,8 +5,16 @@ import os
 # URL MongoDB
 MONGO_URL = os.getenv("MONGODB_URI")
 
-# Création du client MongoDB asynchrone
-client = AsyncIOMotorClient(MONGO_URL)
+# Création du client MongoDB asynchrone (pool préchauffé, compression réseau)
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=3000,
+    retryWrites=True,
+    compressors="zlib"
+)
 
 # Sélection de la base de données
 db = client["aphro_db"]
@@ -17,3 +25,4 @@ likes_collection = db["likes"]
 tokens_collection = db["tokens"]
 messages_collection = db["messages"]
 device_tokens_collection = db["device_tokens"]
+crossings_collection = db["crossings"]
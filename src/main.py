@@ -1,16 +1,18 @@
 # main.py
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, Request
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
 import asyncio, time
+from bson import ObjectId
+from collections import deque
 
 from src import crud, schemas, auth
 from src.database import users_collection, likes_collection, tokens_collection, messages_collection, device_tokens_collection
 from src.chat import websocket_endpoint, manager
-from src.notifications import send_push_notification
+from src.notifications import send_push_batch
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -22,23 +24,35 @@ class RateLimiterMiddleware:
         self.app = app
         self.max_requests = max_requests
         self.window = window
-        self.requests = {}  # user_id -> [timestamps]
+        self.last_sweep = 0.0
+        self.requests: dict[str, deque] = {}  # user_id -> deque de timestamps
 
     async def __call__(self, scope, receive, send):
         if scope["type"] == "http":
             headers = dict(scope["headers"])
             user_id = headers.get(b"x-user-id", b"anonymous").decode()
             now = time.time()
-            timestamps = self.requests.get(user_id, [])
-            timestamps = [t for t in timestamps if now - t < self.window]
+            self._sweep(now)
+            timestamps = self.requests.setdefault(user_id, deque())
+            while timestamps and now - timestamps[0] >= self.window:
+                timestamps.popleft()
             if len(timestamps) >= self.max_requests:
                 response = JSONResponse({"detail": "Too many requests"}, status_code=429)
                 await response(scope, receive, send)
                 return
             timestamps.append(now)
-            self.requests[user_id] = timestamps
         await self.app(scope, receive, send)
 
+    def _sweep(self, now: float):
+        # Oublie les utilisateurs inactifs (au plus un balayage par fenêtre)
+        if now - self.last_sweep < self.window:
+            return
+        self.last_sweep = now
+        for user_id in list(self.requests):
+            timestamps = self.requests[user_id]
+            if not timestamps or now - timestamps[-1] >= self.window:
+                del self.requests[user_id]
+
 # -------------------
 # Dépendance JWT
 # -------------------
@@ -49,51 +63,18 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return payload.get("user_id")
 
 # -------------------
-# Lifespan avec scheduler
+# Lifespan
 # -------------------
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await crud.create_location_index()
-
-    # Scheduler des croisements
-    async def crossing_scheduler():
-        while True:
-            try:
-                detected = await crud.detect_crossings()
-                if detected:
-                    print(f"[Crossing Scheduler] {len(detected)} nouveaux croisements détectés")
-            except Exception as e:
-                print(f"[Crossing Scheduler] Erreur : {e}")
-            await asyncio.sleep(60)
-
-    # Scheduler cleanup tokens expirés
-    async def cleanup_scheduler():
-        while True:
-            now = datetime.now(timezone.utc)
-            await tokens_collection.delete_many({"expires_at": {"$lt": now}})
-            await asyncio.sleep(3600)  # toutes les heures
-
-    task_crossing = asyncio.create_task(crossing_scheduler())
-    task_cleanup = asyncio.create_task(cleanup_scheduler())
-    print("Schedulers démarrés...")
-
+    # Les croisements sont détectés à chaque mise à jour de position (crud.update_location)
+    await crud.create_indexes()
     yield
 
-    task_crossing.cancel()
-    task_cleanup.cancel()
-    try:
-        await task_crossing
-    except asyncio.CancelledError:
-        print("Scheduler crossing arrêté")
-    try:
-        await task_cleanup
-    except asyncio.CancelledError:
-        print("Scheduler cleanup arrêté")
-
 # -------------------
 # Application
 # -------------------
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(RateLimiterMiddleware)
 
 origins = [
@@ -202,15 +183,17 @@ async def like_endpoint(like: schemas.LikeCreate, user_id: str = Depends(get_cur
         raise HTTPException(status_code=403, detail="Vous ne pouvez pas liker pour un autre utilisateur")
     result = await crud.create_like(like.liker_id, like.liked_id)
     if result.get("match"):
-        for uid in [like.liker_id, like.liked_id]:
-            tokens = await device_tokens_collection.find({"user_id": uid}).to_list(None)
-            for t in tokens:
-                await send_push_notification(
-                    t["device_token"],
-                    title="Nouveau match !",
-                    body="Vous avez un nouveau match 🎉",
-                    data={"type": "match"}
-                )
+        manager.notify_new_match(like.liker_id, like.liked_id)
+        tokens = await device_tokens_collection.find(
+            {"user_id": {"$in": [like.liker_id, like.liked_id]}},
+            projection={"_id": 0, "device_token": 1}
+        ).to_list(None)
+        await send_push_batch(
+            [t["device_token"] for t in tokens],
+            title="Nouveau match !",
+            body="Vous avez un nouveau match 🎉",
+            data={"type": "match"}
+        )
     return result
 
 @app.get("/matches/")
@@ -219,9 +202,12 @@ async def matches_endpoint(user_id: str = Depends(get_current_user)):
 
 @app.get("/likes-history/")
 async def likes_history(user_id: str = Depends(get_current_user)):
-    given = await likes_collection.find({"liker_id": user_id}).to_list(None)
-    received = await likes_collection.find({"liked_id": user_id}).to_list(None)
-    matches = [l["liked_id"] for l in given if await likes_collection.find_one({"liker_id": l["liked_id"], "liked_id": user_id})]
+    given, received, matches = await asyncio.gather(
+        likes_collection.find({"liker_id": user_id}, projection={"_id": 0, "liked_id": 1, "created_at": 1}).to_list(None),
+        likes_collection.find({"liked_id": user_id}, projection={"_id": 0, "liker_id": 1, "created_at": 1}).to_list(None),
+        crud.get_matches(user_id)
+    )
+    matches = set(matches)
     return {
         "likes_given": [{"liked_id": l["liked_id"], "created_at": l["created_at"], "match": l["liked_id"] in matches} for l in given],
         "likes_received": [{"liker_id": l["liker_id"], "created_at": l["created_at"], "match": l["liker_id"] in matches} for l in received]
@@ -259,11 +245,30 @@ async def websocket_route(websocket: WebSocket, user_id: str):
 # Historique des messages avec pagination
 # -------------------
 @app.get("/messages/{other_user_id}")
-async def get_messages(other_user_id: str, skip: int = 0, limit: int = 20, user_id: str = Depends(get_current_user)):
-    messages = await messages_collection.find({
+async def get_messages(other_user_id: str, skip: int = 0, limit: int = 20, after_timestamp: datetime | None = None, after_id: str | None = None, user_id: str = Depends(get_current_user)):
+    conditions = [{
         "$or": [
             {"from_user": user_id, "to_user": other_user_id},
             {"from_user": other_user_id, "to_user": user_id}
         ]
-    }).sort("timestamp", 1).skip(skip).limit(limit).to_list(None)
-    return {"messages": messages}
+    }]
+    # Pagination par curseur (timestamp, _id) : évite de parcourir les messages déjà vus avec skip,
+    # _id départage les messages envoyés dans la même milliseconde
+    if after_timestamp is not None:
+        if after_id is None or not ObjectId.is_valid(after_id):
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+        # Borne simple sur timestamp : reportée dans les bornes d'index de chaque branche du $or from/to
+        conditions.append({"timestamp": {"$gte": after_timestamp}})
+        conditions.append({
+            "$or": [
+                {"timestamp": {"$gt": after_timestamp}},
+                {"timestamp": after_timestamp, "_id": {"$gt": ObjectId(after_id)}}
+            ]
+        })
+        skip = 0
+    cursor = messages_collection.find({"$and": conditions}, projection={"from_user": 1, "to_user": 1, "content": 1, "timestamp": 1, "read": 1})
+    cursor = cursor.sort([("timestamp", 1), ("_id", 1)]).skip(skip)
+    messages = await cursor.limit(limit).to_list(None)
+    messages = [{**m, "_id": str(m["_id"])} for m in messages]
+    next_cursor = {"after_timestamp": messages[-1]["timestamp"], "after_id": messages[-1]["_id"]} if messages else None
+    return {"messages": messages, "next_cursor": next_cursor}
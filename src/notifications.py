@@ -5,19 +5,27 @@ from firebase_admin import messaging, credentials, initialize_app
 
 # Charger le JSON du service account depuis la variable d'environnement
 firebase_json = os.getenv("FCM_SERVICE_ACCOUNT")
+firebase_app = None
 
 if firebase_json:
     service_account_info = json.loads(firebase_json)
     cred = credentials.Certificate(service_account_info)
-    initialize_app(cred)
+    # Instance unique : le client HTTP/2 authentifié de send_each_async est réutilisé entre les envois
+    firebase_app = initialize_app(cred)
 else:
     print("⚠️  Aucun compte de service FCM trouvé, les notifications push ne fonctionneront pas.")
 
-async def send_push_notification(device_token: str, title: str, body: str, data: dict = None):
-    message = messaging.Message(
-        notification=messaging.Notification(title=title, body=body),
-        token=device_token,
-        data=data or {}
-    )
-    response = messaging.send(message)
+async def send_push_batch(device_tokens: list[str], title: str, body: str, data: dict = None):
+    # Tous les messages partent ensemble sur une seule connexion HTTP/2
+    if not device_tokens:
+        return None
+    messages = [
+        messaging.Message(
+            notification=messaging.Notification(title=title, body=body),
+            token=device_token,
+            data=data or {}
+        )
+        for device_token in device_tokens
+    ]
+    response = await messaging.send_each_async(messages, app=firebase_app)
     return response